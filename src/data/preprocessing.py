@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
-import csv
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import gc
+from concurrent.futures import ThreadPoolExecutor
 
 
 class DataProcessor:
@@ -48,11 +51,12 @@ class DataProcessor:
         'PS4.txt',  'TS1.txt',  'VS1.txt'
     ]
 
-    # empty dictionary of dataframes
-    _file_dfs = {}
-
     def __init__(self):
-        pass
+        # profile dataframe and empty dictionaries of sensor arrays and
+        #   sensor column names (per instance so runs don't share data)
+        self._profile_df = None
+        self._sensor_arrays = {}
+        self._sensor_columns = {}
 
     def read_data(self, raw_data_path):
         """Read raw data into DataProcessor.
@@ -60,16 +64,20 @@ class DataProcessor:
             Args:
                 raw_data_path: path to raw data directory (data/raw)
         """
-        # read files into dict with filenames as keys (file without .txt)
-        for file in self._important_files:
-            file_path = '{dir}/{file}'.format(dir=raw_data_path, file=file)
+        # file paths for all important files
+        file_paths = [
+            '{dir}/{file}'.format(dir=raw_data_path, file=file)
+            for file in self._important_files]
 
-            # filename minus extension
-            filename = file[:-4]
+        # read files in parallel into dict with filenames as keys
+        #   (file without .txt), map keeps the order of _important_files
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            file_arrays = dict(executor.map(self._read_file, file_paths))
 
-            # read file
-            self._file_dfs[filename] = pd.read_csv(
-                                            file_path, sep='\t', header=None)
+        # profile is kept as a dataframe, sensors are kept as float32 arrays
+        #   until the master dataframe is built
+        self._profile_df = pd.DataFrame(file_arrays.pop('profile'))
+        self._sensor_arrays = file_arrays
 
     def process_data(self, stable=True):
         """Process raw data into useful files for model.
@@ -89,7 +97,8 @@ class DataProcessor:
         self.master_df = self._join_data_to_targets()
 
     def write_data(self, processed_data_path):
-        """Write processed data to directory.
+        """Write processed data to directory. Raw and processed dataframes are
+        released after writing to free memory.
 
             Args:
                 processed_data_path:
@@ -99,20 +108,37 @@ class DataProcessor:
         with open(
                 '{dir}/sensors.csv'
                 .format(dir=processed_data_path),
-                'w', newline='') as sensorfile:
+                'w') as sensorfile:
 
-            csv_sens = csv.writer(sensorfile, delimiter=',')
-            csv_sens.writerow(
-                        [k for k in self._file_dfs.keys() if k != 'profile'])
+            sensorfile.write(','.join(self._sensor_arrays.keys()) + '\n')
 
         # write data to files
-        self.master_df['X'].to_csv(
-                                '{dir}/features.csv'
-                                .format(dir=processed_data_path))
+        # features are wide, so they are written with the columnar arrow
+        #   csv writer, index goes first with an empty header like to_csv
+        features = self.master_df['X']
+
+        # build the arrow table straight from the column-major feature
+        #   values, each column is a zero-copy slice (from_pandas converts
+        #   the ~40k columns one by one through pandas)
+        feature_vals = np.asfortranarray(features.to_numpy())
+        feature_table = pa.Table.from_arrays(
+            [pa.array(features.index)]
+            + [pa.array(col) for col in feature_vals.T],
+            names=[''] + list(features.columns))
+        pa_csv.write_csv(
+                feature_table,
+                '{dir}/features.csv'.format(dir=processed_data_path))
         self.master_df['y'].to_csv(
                                 '{dir}/targets.csv'
                                 .format(dir=processed_data_path))
 
+        # release the dataframes so memory is freed between runs
+        self._profile_df = None
+        self._sensor_arrays = {}
+        self._sensor_columns = {}
+        self.master_df = None
+        gc.collect()
+
     def _standardize_targets(self, stable):
         """Worker function to change faults from bar, percent, etc to ordinal
         degree of failure (0 = no failure, 3/4 = critical)
@@ -121,80 +147,95 @@ class DataProcessor:
             # get the targets for stable = 0 (conditions are stable)
             #   and drop 'stable'
             targets = (
-                self._file_dfs['profile']
-                [self._file_dfs['profile']['stable'] == 0]
+                self._profile_df
+                [self._profile_df['stable'] == 0]
                 .drop('stable', axis='columns'))
         else:
             # drop 'stable' column
             targets = (
-                self._file_dfs['profile']
+                self._profile_df
                 .drop('stable', axis='columns'))
 
         # make faults ordinal by degree of failure
-        cooler_eff_map_dict = {100: 0, 20: 1, 3: 2}
-        valve_perc_map_dict = {100: 0, 90: 1, 80: 2, 73: 3}
-        accu_prs_map_dict = {130: 0, 115: 1, 100: 2, 90: 3}
-
-        # apply map
-        targets['cooler_eff'] = targets['cooler_eff'].map(cooler_eff_map_dict)
-        targets['valve_perc'] = targets['valve_perc'].map(valve_perc_map_dict)
-        targets['accu_prs'] = targets['accu_prs'].map(accu_prs_map_dict)
-
-        # build 'id map'
-        # get the uniqe targets
-        uniq_targets = (
-            targets
-            .sort_values(['cooler_eff', 'valve_perc', 'pump_leak', 'accu_prs'])
-            .drop_duplicates()
-            .reset_index(drop=True))
-
-        # set 'int_id' to string concatenation of all columns in each row
-        uniq_targets['int_id'] = uniq_targets.apply(
-                                    lambda x: str(list(x)), axis=1)
-
-        # set 'id' to index (0..number of unique rows)
-        uniq_targets['id'] = uniq_targets.index
-
-        # set 'id_map' to dictionary with 'int_id' key and 'id' value
-        uniq_targets['id_map'] = uniq_targets.apply(
-                                    lambda x: {x['int_id']: x['id']}, axis=1)
-
-        # build the id_map dictionary
-        id_map = {}
-        for val in uniq_targets.id_map.values:
-            id_map.update(val)
-
-        # map on targets
-        targets['fault_id'] = (
-            targets
-            .apply(lambda x: str(list(x)), axis=1)
-            .map(id_map))
+        #   (position in the list = degree of failure)
+        cooler_eff_levels = [100, 20, 3]
+        valve_perc_levels = [100, 90, 80, 73]
+        accu_prs_levels = [130, 115, 100, 90]
+
+        # look up the position of each value in the list
+        targets['cooler_eff'] = self._to_ordinal(
+                                    targets['cooler_eff'], cooler_eff_levels)
+        targets['valve_perc'] = self._to_ordinal(
+                                    targets['valve_perc'], valve_perc_levels)
+        targets['accu_prs'] = self._to_ordinal(
+                                    targets['accu_prs'], accu_prs_levels)
+
+        # pump_leak is already ordinal (0-2), store it as int8 like the
+        #   other fault columns
+        targets['pump_leak'] = targets['pump_leak'].astype(np.int8)
+
+        # build 'fault_id' from the unique combinations of the fault columns
+        # all fault columns fit in 8 bits, so pack each row into one uint32
+        #   key (packing keeps the sorted order of the combinations)
+        packed_faults = (
+            (targets['cooler_eff'].to_numpy().astype(np.uint32) << 24)
+            | (targets['valve_perc'].to_numpy().astype(np.uint32) << 16)
+            | (targets['pump_leak'].to_numpy().astype(np.uint32) << 8)
+            | targets['accu_prs'].to_numpy().astype(np.uint32))
+
+        # sort = True numbers the keys in sorted order (0..number of keys)
+        fault_codes, _ = pd.factorize(packed_faults, sort=True)
+
+        targets['fault_id'] = fault_codes
 
         return targets
 
+    @staticmethod
+    def _to_ordinal(fault, levels):
+        """Worker function to convert fault values to their int8 position in
+        `levels` (-1 for values not in `levels`). Fault values are small
+        non-negative integers, so a dense lookup table indexed by value
+        replaces hashing each value.
+        """
+        fault_vals = fault.to_numpy()
+
+        # lookup table from fault value to position in levels
+        lookup_len = max(fault_vals.max(initial=0), max(levels)) + 1
+        lookup = np.full(lookup_len, -1, dtype=np.int8)
+        lookup[levels] = np.arange(len(levels))
+
+        return lookup[fault_vals]
+
     def _join_data_to_targets(self):
         """Worker function to join data (features) to targets (failures). Returns
         a single dataframe with data under 'X' and targets under 'y' column
         multi-index.
         """
-        # concat sensor name to front of time
-        for k, v in self._file_dfs.items():
-            if k != 'profile':
-                self._file_dfs[k].columns = (
-                    '{k} '.format(k=k) + np.round(v.columns, 2).astype(str))
+        # select the rows of the targets, the targets index is the row
+        #   number of the test so this is a plain gather (no join needed)
+        targ_index = self.processed_targets.index
+        targ_rows = targ_index.to_numpy()
+
+        # allocate the features once and fill in each sensor's target rows
+        #   (one copy, no intermediate array of all tests)
+        n_feats = sum(arr.shape[1] for arr in self._sensor_arrays.values())
+        features = np.empty((len(targ_rows), n_feats), dtype=np.float32)
 
-        # join all the data dfs
-        master_df = pd.DataFrame()
+        start = 0
+        for arr in self._sensor_arrays.values():
+            end = start + arr.shape[1]
+            features[:, start:end] = arr[targ_rows]
+            start = end
 
-        for filename, df in self._file_dfs.items():
-            if filename != 'profile':
-                if master_df.empty:
-                    master_df = df
-                else:
-                    master_df = master_df.join(df, how='right')
+        feature_names = np.concatenate(list(self._sensor_columns.values()))
 
-        # join targets to data
-        master_df = master_df.join(self.processed_targets, how='right')
+        # build the data df without copying the features again
+        master_df = pd.DataFrame(
+                        features, index=targ_index, columns=feature_names,
+                        copy=False)
+
+        # add targets to data (same index, so no alignment work)
+        master_df[self.processed_targets.columns] = self.processed_targets
 
         # Put 'X' and 'y' above columns for data, targets respectively
         # length of targets (y)
@@ -206,14 +247,12 @@ class DataProcessor:
         # get target (y) columns from DF
         targ_ind = master_df.columns[-targ_len:]
 
-        # build multi-index by multiplying ['y'] and ['X'] by column names
-        # whichever is first = top level in multi-index
-        targ_mind = pd.MultiIndex.from_product([['y'], targ_ind])
-        feat_mind = pd.MultiIndex.from_product([['X'], feat_ind])
-
-        # union puts 'feat_mind' to left of 'targ_mind'
-        # sort = False to keep same order as DF
-        master_mind = feat_mind.union(targ_mind, sort=False)
+        # build multi-index directly from the top level ('X' for each
+        #   feature, 'y' for each target) and the DF column names
+        master_mind = pd.MultiIndex.from_arrays([
+            np.concatenate([
+                np.full(len(feat_ind), 'X'), np.full(len(targ_ind), 'y')]),
+            np.concatenate([feat_ind.values, targ_ind.values])])
 
         # set DF columns = multi-index
         master_df.columns = master_mind
@@ -222,30 +261,44 @@ class DataProcessor:
 
     def _name_columns(self):
         """Worker function to change names of columns according to UCI
-        description.txt and add 0-60 second timestamps to columns.
+        description.txt and add sensor names and 0-60 second timestamps to
+        columns.
         """
         # name target columns according to description
-        self._file_dfs['profile'] = (
-            self._file_dfs['profile'].rename({
-                0: 'cooler_eff', 1: 'valve_perc', 2: 'pump_leak',
-                3: 'accu_prs', 4: 'stable'
-            }, axis='columns')
-        )
+        #   (assigned in place, rename would copy the dataframe)
+        self._profile_df.columns = [
+            'cooler_eff', 'valve_perc', 'pump_leak', 'accu_prs', 'stable']
+
+        # name sensor columns according to time in test
+        self._sensor_columns = {}
+
+        for name, arr in self._sensor_arrays.items():
 
-        # rename columns according to time in test
-        for name, df in self._file_dfs.items():
+            # number of observations per test
+            n_cols = arr.shape[1]
 
-            if name != 'profile':
+            # time interval of the sensor
+            time_int = 60/n_cols
 
-                # time interval of the sensor
-                time_int = 60/len(df.columns)
+            # new_cols is in seconds, i.e. 0.1, 0.2, 0.3...
+            new_cols = np.arange(1, n_cols + 1, dtype=np.float64) * time_int
+
+            # concat sensor name to front of time, i.e. 'PS1 0.01'
+            self._sensor_columns[name] = np.char.add(
+                '{name} '.format(name=name),
+                np.round(new_cols, 2).astype('U'))
+
+    def _read_file(self, file_path):
+        """Worker function to read a single raw data file. Returns a tuple of
+        the filename (without .txt) and the file's array.
+        """
+        # filename minus directory and extension
+        filename = file_path.split('/')[-1][:-4]
 
-                # new_cols is in seconds, i.e. 0.1, 0.2, 0.3...
-                new_cols = df.columns * time_int + time_int
-                old_cols = df.columns.values
+        # profile holds integer fault values, sensors hold floats
+        dtype = np.int64 if filename == 'profile' else np.float32
 
-                # dict for df.rename()
-                colnames = dict(zip(old_cols, new_cols))
+        # read file straight into an array (files are numeric only)
+        file_arr = np.loadtxt(file_path, dtype=dtype, delimiter='\t', ndmin=2)
 
-                # rename
-                self._file_dfs[name] = df.rename(colnames, axis='columns')
+        return filename, file_arr